@@ -9,6 +9,9 @@ class Controller:
 
     _instance = None
     levels: ClassVar[list[type["Level"]]] = []
+    # Indexes of the registered levels, so lookups don't need to scan all levels
+    _level_ids: ClassVar[set[int]] = set()
+    _levels_by_position: ClassVar[dict[tuple[int, int], type["Level"]]] = {}
 
     def __new__(cls, *args, **kwargs) -> "Controller":  # noqa: ANN002, ANN003
         """Create a singleton instance of the Controller.
@@ -26,19 +29,18 @@ class Controller:
 
         Raises a ValueError if a level with the same id or map position already exists.
         """
-        if level.id in self.levels:
+        if level.id in self._level_ids:
             raise ValueError
-        if level.map_position in [level.map_position for level in self.levels]:
+        if level.map_position in self._levels_by_position:
             raise ValueError
         self.levels.append(level)
+        self._level_ids.add(level.id)
+        self._levels_by_position[level.map_position] = level
 
     def get_level(self, position: tuple[int, int]) -> type["Level"] | None:
         """Get the level at a given map position, or return None if no level exists."""
-        for level in self.levels:
-            if level.map_position == position:
-                return level
-        return None
+        return self._levels_by_position.get(position)
 
     def is_level(self, position: tuple[int, int]) -> bool:
         """Check if a level exists at the given map position."""
-        return any(level.map_position == position for level in self.levels)
+        return position in self._levels_by_position
@@ -5,7 +5,7 @@ from typing import Protocol
 import discord
 from controller import Controller
 from discord import Interaction
-from map import Map, generate_map, image_to_discord_file
+from map import Map, generate_map_file_async
 from questions import Question, QuestionStatus, question_factory
 
 with Path.open(Path("bot/questions.json")) as f:
@@ -58,12 +58,10 @@ class Level(Protocol):
 
     async def return_to_map(self, interaction: Interaction, map: Map) -> None:
         """Return to the map after the level is exited."""
-        img = image_to_discord_file(
-            generate_map(
-                map.position,
-                player_name=interaction.user.display_name,
-            ),
-            image_name := "image",
+        img = await generate_map_file_async(
+            map.position,
+            player_name=interaction.user.display_name,
+            file_name=(image_name := "image"),
         )
         embed = discord.Embed(
             title=f"\U0001f5fa {interaction.user.display_name}'s map",
@@ -7,10 +7,10 @@ from controller import Controller
 from discord.ext import commands
 from dotenv import load_dotenv
 from levels import register_all_levels
-from map import Map, generate_map, image_to_discord_file
+from map import Map, generate_map_file_async
 from paginator import Paginator
 from story import StoryPage, StoryView
-from utils.eval import eval_python
+from utils.eval import coalesced_eval_python
 
 load_dotenv()
 
@@ -68,12 +68,10 @@ async def get_map(interaction: discord.Interaction) -> None:
         return
     await story.last_interaction.response.defer()
 
-    img = image_to_discord_file(
-        generate_map(
-            (0, 0),
-            player_name=interaction.user.display_name,
-        ),
-        image_name := "image",
+    img = await generate_map_file_async(
+        (0, 0),
+        player_name=interaction.user.display_name,
+        file_name=(image_name := "image"),
     )
     embed = discord.Embed(
         title=f"\U0001f5fa {interaction.user.display_name}'s map",
@@ -89,7 +87,7 @@ async def eval_code(interaction: discord.Interaction, *, code: str) -> None:
     """Evaluate Python code and return the output."""
     await interaction.response.defer(ephemeral=True)
     try:
-        output = await eval_python(code)
+        output = await coalesced_eval_python(code)
         output = (
             ":white_check_mark: Your Python 3 eval job succeeded.\n\n**Output**\n```py\n" + output[:2000] + "\n```"
         )
@@ -1,5 +1,9 @@
+import asyncio
+import functools
 import io
 import json
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
 from pathlib import Path
 
 import discord
@@ -14,19 +18,133 @@ path_font = font_manager.findfont(font_manager.FontProperties(family="sans-serif
 
 CAMERA_H = 400
 CAMERA_W = 600
+_HALF_CAMERA_H = round(CAMERA_H / 2)
+_HALF_CAMERA_W = round(CAMERA_W / 2)
 SquareOrigo = (637, 1116.5)
 SquareDeltaX = (111.3, -52)  # Pixels travelled when moving X on map
 SquareDeltaY = (111.3, 52)  # Pixels travelled when moving Y on map
 SquareDeltaZ = (0, -105)  # Pixels travelled when moving Z on map
+# zlib level used when encoding maps. Level 1 encodes about twice as fast as Pillow's default of 6,
+# at the cost of ~15% larger files.
+PNG_COMPRESS_LEVEL = 1
+NAME_FONT_MAX_SIZE = 24
+NAME_FONT_MIN_SIZE = 6
 
 
 with Path.open(path_bot / "map_z.json") as f:
     map_z = json.load(f)
 
 
+def _pixel_xy(x: int, y: int, z: int) -> tuple[float, float]:
+    """Return the pixel position of a map coordinate on the map image.
+
+    The position is not rounded, so pixel offsets can be added before rounding.
+    """
+    return (
+        SquareOrigo[0] + x * SquareDeltaX[0] + y * SquareDeltaY[0] + z * SquareDeltaZ[0],
+        SquareOrigo[1] + x * SquareDeltaX[1] + y * SquareDeltaY[1] + z * SquareDeltaZ[1],
+    )
+
+
+# The map is static, so the pixel position of every map coordinate is computed once
+_PIXEL_XY = {(int(x), int(y)): _pixel_xy(int(x), int(y), z) for x, column in map_z.items() for y, z in column.items()}
+
+# Bit and move of each arrow button.
+# _NAV_MASK holds, for every map coordinate, the bits of the moves that stay on the map.
+_NAV_BUTTON_MOVES = {
+    "button_left": (1, (-1, 0)),
+    "button_up": (2, (0, -1)),
+    "button_right": (4, (1, 0)),
+    "button_down": (8, (0, 1)),
+}
+_NAV_MASK = {
+    (x, y): sum(bit for bit, (dx, dy) in _NAV_BUTTON_MOVES.values() if (x + dx, y + dy) in _PIXEL_XY)
+    for x, y in _PIXEL_XY
+}
+
+
+@functools.lru_cache(maxsize=32)
+def _font(size: int) -> ImageFont.FreeTypeFont:
+    """Load the name box font in the given size. Loading parses the font file, so the fonts are cached."""
+    return ImageFont.truetype(path_font, size)
+
+
+def _load_asset(path: Path, mode: str) -> Image.Image:
+    """Open an image asset and decode it in the given mode."""
+    return Image.open(path).convert(mode)
+
+
+# The map assets never change while the bot is running, so they are decoded once here instead of on every render.
+# Only crops and copies are taken from these images, never modify them in place.
+# The map has no transparency and stays RGB, so parts of the camera box outside the map crop to opaque black.
+# The assets and all name box font sizes are loaded in parallel, so the first render doesn't have to wait for them.
+with ThreadPoolExecutor(max_workers=4) as _loader:
+    _images = _loader.map(
+        _load_asset,
+        (path_maps / "map-done-abc.png", path_assets / "player.png", path_assets / "name-box.png"),
+        ("RGB", "RGBA", "RGBA"),
+    )
+    _fonts = _loader.map(_font, range(NAME_FONT_MIN_SIZE, NAME_FONT_MAX_SIZE + 1))
+    _MAP_IMG, _PLAYER_IMG, _NAMEBOX_IMG = _images
+    list(_fonts)  # Raise any error from loading the fonts
+
+# Where the player and the name box are pasted on the camera image
+_PLAYER_XY = (
+    round(CAMERA_W / 2 - _PLAYER_IMG.width / 2),
+    round(CAMERA_H / 2 - _PLAYER_IMG.height / 2),
+)
+_NAMEBOX_XY = (
+    round(CAMERA_W / 2 - _NAMEBOX_IMG.width / 2),
+    _PLAYER_XY[1] - 40,
+)
+
+
+def _compose_player_overlay(*, with_name_box: bool) -> tuple[Image.Image, tuple[int, int]]:
+    """Compose the player, and optionally the name box, into one overlay so it can be pasted in one go.
+
+    Returns the overlay and where to paste it on the camera image.
+    """
+    layers = [(_PLAYER_IMG, _PLAYER_XY)]
+    if with_name_box:
+        layers.append((_NAMEBOX_IMG, _NAMEBOX_XY))
+    left = min(x for _, (x, _) in layers)
+    top = min(y for _, (_, y) in layers)
+    right = max(x + img.width for img, (x, _) in layers)
+    bottom = max(y + img.height for img, (_, y) in layers)
+    overlay = Image.new("RGBA", (right - left, bottom - top))
+    for img, (x, y) in layers:
+        overlay.alpha_composite(img, (x - left, y - top))
+    return overlay, (left, top)
+
+
+_PLAYER_OVERLAY, _PLAYER_OVERLAY_XY = _compose_player_overlay(with_name_box=False)
+_NAMEBOX_OVERLAY, _NAMEBOX_OVERLAY_XY = _compose_player_overlay(with_name_box=True)
+
+
 def validate_coord(coord: tuple[int, int]) -> bool:
     """Return whether or not the coordinate is not in the map."""
-    return not (map_z.get(str(coord[0])) is None or map_z[str(coord[0])].get(str(coord[1])) is None)
+    return coord in _PIXEL_XY
+
+
+@functools.cache
+def _map_cache_channel_id() -> int | None:
+    """Return the ID set with MAP_CACHE_CHANNEL_ID, or None if it is not set or not a valid ID.
+
+    The ID is read on first use instead of at import, since the .env file is loaded after this module is imported.
+    """
+    try:
+        return int(getenv("MAP_CACHE_CHANNEL_ID", ""))
+    except ValueError:
+        return None
+
+
+def map_cache_channel(client: discord.Client) -> discord.TextChannel | None:
+    """Return the channel maps are uploaded to, or None if it is not configured or not a text channel."""
+    channel_id = _map_cache_channel_id()
+    if channel_id is None:
+        return None
+    channel = client.get_channel(channel_id)
+    return channel if isinstance(channel, discord.TextChannel) else None
 
 
 class Map(discord.ui.View):
@@ -36,6 +154,8 @@ class Map(discord.ui.View):
         super().__init__(timeout=180)
         self.position = position
         self.user = user
+        # URLs of maps uploaded to the map cache channel, keyed by position and player name
+        self._url_cache: dict[tuple[tuple[int, int], str], str] = {}
 
     async def move(
         self,
@@ -63,49 +183,84 @@ class Map(discord.ui.View):
 
         return f"## {level.name}: {level.topic}\nPress <:check:1265079659448766506> to start the level."
 
-    def update_buttons(self) -> None:
-        """Update the buttons to match the current position."""
-
-        def should_disable(x: int, y: int) -> bool:
-            return not validate_coord((x, y))
-
-        x, y = self.position
+    def update_buttons(self, position: tuple[int, int]) -> None:
+        """Update the buttons to match the given position."""
+        nav_mask = _NAV_MASK.get(position, 0)
         for child in self.children:
             if not isinstance(child, discord.ui.Button):
                 continue
-            if child.custom_id == "button_left":
-                child.disabled = should_disable(x - 1, y)
-            if child.custom_id == "button_up":
-                child.disabled = should_disable(x, y - 1)
-            if child.custom_id == "button_down":
-                child.disabled = should_disable(x, y + 1)
-            if child.custom_id == "button_right":
-                child.disabled = should_disable(x + 1, y)
+            if child.custom_id in _NAV_BUTTON_MOVES:
+                bit, _ = _NAV_BUTTON_MOVES[child.custom_id]
+                child.disabled = not nav_mask & bit
             if child.custom_id == "button_confirm":
-                child.disabled = not Controller().is_level(self.position)
+                child.disabled = not Controller().is_level(position)
 
     async def navigate(
         self,
         interaction: discord.Interaction,
     ) -> None:
         """Update map to the new position."""
+        # Other clicks can move the player while this one awaits, so the whole edit is built from one position
+        position = self.position
         embed = discord.Embed(
             title=f"\U0001f5fa {self.user.display_name}'s Map",
             color=discord.Color.blurple(),
         )
-        embed.description = self.get_embed_description(self.position)
-        img = image_to_discord_file(
-            generate_map(self.position, player_name=self.user.display_name),
-            image_name := "image",
-        )
-        embed.set_image(url=f"attachment://{image_name}.png")
-        self.update_buttons()
-
-        await interaction.response.edit_message(
-            embed=embed,
-            attachments=[img],
-            view=self,
-        )
+        embed.description = self.get_embed_description(position)
+        url = self._url_cache.get((position, self.user.display_name))
+        channel = map_cache_channel(interaction.client)
+        if url is None and channel is not None:
+            # The upload to the map cache channel is an extra round trip, so acknowledge the interaction first
+            await interaction.response.defer()
+            url = await self.upload_map(channel, position)
+        if url is None:
+            attachments = [
+                await generate_map_file_async(
+                    position,
+                    player_name=self.user.display_name,
+                    file_name=(image_name := "image"),
+                ),
+            ]
+            embed.set_image(url=f"attachment://{image_name}.png")
+        else:
+            attachments = []
+            embed.set_image(url=url)
+        if position != self.position:
+            # A later click moved the player while this one awaited. Its edit shows the current position,
+            # so don't risk this stale edit arriving after it.
+            if not interaction.response.is_done():
+                await interaction.response.defer()
+            return
+        self.update_buttons(position)
+
+        if interaction.response.is_done():
+            await interaction.edit_original_response(
+                embed=embed,
+                attachments=attachments,
+                view=self,
+            )
+        else:
+            await interaction.response.edit_message(
+                embed=embed,
+                attachments=attachments,
+                view=self,
+            )
+
+    async def upload_map(self, channel: discord.TextChannel, position: tuple[int, int]) -> str | None:
+        """Upload the map at the given position to the map cache channel and return its URL.
+
+        Uploaded maps are remembered for the lifetime of the view, so revisiting a position skips rendering and
+        uploading. Returns None if the upload fails, in which case the map should be attached to the message.
+        """
+        try:
+            message = await channel.send(
+                file=await generate_map_file_async(position, player_name=self.user.display_name),
+            )
+        except discord.HTTPException as e:
+            print("Unable to upload map to the map cache channel: ", e)
+            return None
+        url = self._url_cache[(position, self.user.display_name)] = message.attachments[0].url
+        return url
 
     @discord.ui.button(
         emoji=discord.PartialEmoji.from_str("<:arrowleft:1265077268951339081>"),
@@ -186,28 +341,22 @@ def get_camera_box(
 
     offset is specified in pixels.
     """
-    x, y = position
-    z = map_z[str(x)][str(y)]
-    pos_x = round(
-        SquareOrigo[0] + x * SquareDeltaX[0] + y * SquareDeltaY[0] + z * SquareDeltaZ[0] + offset[0],
-    )
-    pos_y = round(
-        SquareOrigo[1] + x * SquareDeltaX[1] + y * SquareDeltaY[1] + z * SquareDeltaZ[1] + offset[1],
-    )
+    pixel_x, pixel_y = _PIXEL_XY[position]
+    pos_x = round(pixel_x + offset[0])
+    pos_y = round(pixel_y + offset[1])
     return (
-        pos_x - round(CAMERA_W / 2),
-        pos_y - round(CAMERA_H / 2),
-        pos_x + round(CAMERA_W / 2),
-        pos_y + round(CAMERA_H / 2),
+        pos_x - _HALF_CAMERA_W,
+        pos_y - _HALF_CAMERA_H,
+        pos_x + _HALF_CAMERA_W,
+        pos_y + _HALF_CAMERA_H,
     )
 
 
-def image_to_discord_file(image: Image.Image, file_name: str = "image") -> discord.File:
-    """Get a discord.File from a Pillow.Image.Image. Do not include extension in the file name."""
-    with io.BytesIO() as image_binary:
-        image.save(image_binary, "PNG")
-        image_binary.seek(0)
-        return discord.File(fp=image_binary, filename=file_name + ".png")
+def _encode_png(image: Image.Image) -> bytes:
+    """Encode a Pillow.Image.Image as PNG bytes."""
+    image_binary = io.BytesIO()
+    image.save(image_binary, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return image_binary.getvalue()
 
 
 def _crop_map(
@@ -218,56 +367,48 @@ def _crop_map(
     """Crop the map so the camera centers on the given position, with the given offset.
 
     The function currently only supports the fully unlocked map.
+    Only the camera window is copied out of the already decoded map, so the cost does not grow with the map size.
     """
-    img = Image.open(path_maps / "map-done-abc.png")
-    box = get_camera_box(position, offset)
-    return img.crop(box)
+    return _MAP_IMG.crop(get_camera_box(position, offset))
 
 
-def draw_player(position: tuple[int, int]) -> tuple[Image.Image, int]:
+def draw_player(position: tuple[int, int], player_name: str | None = None) -> Image.Image:
     """Draw the player on the map centered on the given position.
 
-    Returns the map with the player on it and the player's height.
+    If player_name is given, a name box with the player's name is drawn above the player.
     """
-    player = Image.open(path_assets / "player.png").convert("RGBA")
-    player_w, player_h = player.size
-    offset = (0, round(-player_h / 2))
-    bg = _crop_map(position, offset=offset).convert("RGBA")
-    bg.paste(
-        player,
-        (
-            round(CAMERA_W / 2 - player_w / 2),
-            round(CAMERA_H / 2 - player_h / 2),
-        ),
-        player,
-    )
-    return bg, player_h
+    bg = _crop_map(position, offset=(0, round(-_PLAYER_IMG.height / 2)))
+    if player_name is None:
+        overlay, overlay_xy = _PLAYER_OVERLAY, _PLAYER_OVERLAY_XY
+    else:
+        overlay, overlay_xy = _NAMEBOX_OVERLAY.copy(), _NAMEBOX_OVERLAY_XY
+        draw_name_box(overlay, player_name)
+    bg.paste(overlay, overlay_xy, overlay)  # The overlay is its own mask, so the RGB map shows through it
+    return bg
 
 
-def draw_name_box(bg: Image.Image, player_name: str, player_h: int) -> None:
-    """Draw a name box with the player's name on the map."""
-    name_box = Image.open(path_assets / "name-box.png").convert("RGBA")
-    name_box_w, name_box_h = name_box.size
-    bg.paste(
-        name_box,
-        (
-            round(CAMERA_W / 2 - name_box_w / 2),
-            round(CAMERA_H / 2 - player_h / 2 - 40),
-        ),
-        name_box,
-    )
-    draw = ImageDraw.Draw(bg)
-
-    fontsize = 24
-    font = ImageFont.truetype(path_font, fontsize)
-    while font.getlength(player_name) > name_box_w - 10:
-        # Decrease font size until the text fits in the box
-        fontsize -= 1
-        font = ImageFont.truetype(path_font, fontsize)
+def _fit_font(text: str, width: float) -> ImageFont.FreeTypeFont:
+    """Return the font in the largest size the text fits in the given width, but no smaller than the minimum size."""
+    low, high = NAME_FONT_MIN_SIZE, NAME_FONT_MAX_SIZE
+    while low < high:  # Binary search for the largest size that fits
+        size = (low + high + 1) // 2
+        if _font(size).getlength(text) <= width:
+            low = size
+        else:
+            high = size - 1
+    return _font(low)
+
+
+def draw_name_box(overlay: Image.Image, player_name: str) -> None:
+    """Write the player's name in the name box of a copy of the name box overlay."""
+    name_box_w, name_box_h = _NAMEBOX_IMG.size
+    draw = ImageDraw.Draw(overlay)
+
+    font = _fit_font(player_name, name_box_w - 10)
     left, top, _, bottom = draw.textbbox(
         (
-            round(CAMERA_W / 2),
-            round(CAMERA_H / 2 - player_h / 2 - 40),
+            _HALF_CAMERA_W - _NAMEBOX_OVERLAY_XY[0],
+            _NAMEBOX_XY[1] - _NAMEBOX_OVERLAY_XY[1],
         ),
         player_name,
         font=font,
@@ -299,10 +440,59 @@ def generate_map(
     """
     if not with_player:
         return _crop_map(position)
-    bg, player_h = draw_player(position)
+    return draw_player(position, player_name)
 
-    if player_name is None:
-        return bg
-    draw_name_box(bg, player_name, player_h)
 
-    return bg
+@functools.lru_cache(maxsize=256)
+def _render_map(position: tuple[int, int], *, with_player: bool, player_name: str | None) -> bytes:
+    """Generate a map and return it encoded as PNG.
+
+    The result is cached, since players often move back and forth over the same positions.
+    """
+    return _encode_png(generate_map(position, with_player=with_player, player_name=player_name))
+
+
+def generate_map_file(
+    position: tuple[int, int],
+    *,
+    with_player: bool = True,
+    player_name: str | None = None,
+    file_name: str = "image",
+) -> discord.File:
+    """Generate a map centered on the provided map coordinate and return it as a discord.File.
+
+    See `generate_map` for the arguments. Do not include extension in the file name.
+    Rendered maps are cached, call `clear_map_cache` if the map assets change.
+    """
+    image_binary = io.BytesIO(_render_map(position, with_player=with_player, player_name=player_name))
+    return discord.File(fp=image_binary, filename=file_name + ".png")
+
+
+async def generate_map_file_async(
+    position: tuple[int, int],
+    *,
+    with_player: bool = True,
+    player_name: str | None = None,
+    file_name: str = "image",
+) -> discord.File:
+    """Run `generate_map_file` in a worker thread.
+
+    Rendering takes tens of milliseconds, which would otherwise block the event loop and delay the bot's heartbeats.
+    Pillow releases the GIL while cropping, pasting and encoding, so those steps of renders for several users can
+    overlap. Drawing the player's name holds the GIL.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        None,
+        functools.partial(
+            generate_map_file,
+            position,
+            with_player=with_player,
+            player_name=player_name,
+            file_name=file_name,
+        ),
+    )
+
+
+def clear_map_cache() -> None:
+    """Clear the cache of rendered maps."""
+    _render_map.cache_clear()
@@ -7,12 +7,24 @@ from typing import Protocol
 import discord
 from discord import Embed, Interaction, TextStyle
 from discord.ui.view import View
-from utils.eval import eval_python
+from utils.eval import coalesced_eval_python
 
 if typing.TYPE_CHECKING:
     from levels import Level
 
 check_test = re.compile(r"Ran 1 test in \S+s\n\nOK\n$")  # Successful unit tests output should end with this
+check_test_tail = 64  # check_test only needs to search this many characters at the end of the output
+option_emojis = {  # Emojis for the multiple choice option buttons, by option ID
+    option_id: discord.PartialEmoji.from_str(emoji)
+    for option_id, emoji in {
+        "a": "<:letter_a:1265996405164474368>",
+        "b": "<:letter_b:1265996406028636232>",
+        "c": "<:letter_c:1265996407647768716>",
+        "d": "<:letter_d:1265996409040277595>",
+        "e": "<:letter_e:1265996410453622945>",
+        "f": "<:letter_a:1265996405164474368>",
+    }.items()
+}
 
 
 class Question(Protocol):
@@ -47,6 +59,7 @@ class Question(Protocol):
     question: str
     hints: list[str]
     unlocked_hints: int  # Indexes of unlocked hints
+    _hint_block: str = ""  # Unlocked hints section of the embed description, rebuilt when a hint is unlocked
 
     def __str__(self) -> str:
         """Return the question text."""
@@ -57,11 +70,15 @@ class Question(Protocol):
         """Check if the answer is correct."""
         raise NotImplementedError
 
+    def unlock_hint(self) -> None:
+        """Unlock the next hint, unless all hints are already unlocked."""
+        if self.unlocked_hints < len(self.hints):
+            self.unlocked_hints += 1
+            self._hint_block = "\n\n*Hints:*\n" + "\n".join(self.hints[: self.unlocked_hints])
+
     def get_embed_description(self, question_index: int) -> str:
         """Return the description for the embed message."""
-        return f"## Question {question_index}\n{self.question}" + (
-            "\n\n*Hints:*\n" + "\n".join(self.hints[: self.unlocked_hints]) if self.unlocked_hints else ""
-        )
+        return f"## Question {question_index}\n{self.question}{self._hint_block}"
 
     def embed(self, level: "Level", question_index: int) -> Embed:
         """Return an embed message for the question."""
@@ -109,8 +126,7 @@ class QuestionView(View):
     )
     async def get_a_hint(self, interaction: discord.Interaction, _: discord.ui.Button) -> None:
         """Reveal one more hint."""
-        if self.question.unlocked_hints < len(self.question.hints):
-            self.question.unlocked_hints += 1
+        self.question.unlock_hint()
         hints = "- " + "\n- ".join(self.question.hints[: self.question.unlocked_hints])
         await interaction.response.send_message(
             content=f"### Hints ({self.question.unlocked_hints}/{len(self.question.hints)})\n" + hints,
@@ -194,17 +210,7 @@ class MultipleChoiceQuestionView(QuestionView):
 
     @staticmethod
     def _emoji(option_id: str) -> discord.PartialEmoji:
-        ids = {
-            "a": "<:letter_a:1265996405164474368>",
-            "b": "<:letter_b:1265996406028636232>",
-            "c": "<:letter_c:1265996407647768716>",
-            "d": "<:letter_d:1265996409040277595>",
-            "e": "<:letter_e:1265996410453622945>",
-            "f": "<:letter_a:1265996405164474368>",
-        }
-        return discord.PartialEmoji.from_str(
-            ids[option_id],
-        )
+        return option_emojis[option_id]
 
     def add_option_button(self, option_id: str, label: str) -> None:
         """Add a button for an option."""
@@ -264,6 +270,21 @@ class WriteCodeQuestion(Question):
         self.pre_code = pre_code
         self.unlocked_hints = 0
         self.test_cases = test_cases
+        # Everything but the user's code is the same for every submission, so it is only built once
+        test_strings = [
+            self._get_assert_equal_string(test_case["input"], test_case["output"]) for test_case in test_cases
+        ]
+        self._test_prefix = (
+            "import unittest\n"  # Import unittest module
+            + ("" if pre_code is None else pre_code)  # Adds code to run before user code, no newline after
+        )
+        self._test_suffix = (
+            "\nclass Test(unittest.TestCase):\n"  # Setup test class
+            " def test_cases(self):"  # Setup test method
+            "\n  "  # Indentation for first test case
+            + "\n  ".join(test_strings)  # Add assertions for test cases
+            + "\nunittest.main()"  # Run unit tests
+        )
 
     async def check_response(self, code: str) -> bool:
         """Check if the code answer is correct.
@@ -273,8 +294,9 @@ class WriteCodeQuestion(Question):
         Raises an error if a connection to the code evaluation service fails.
         """
         test_string = self._get_test_string(code)
-        output = await eval_python(test_string)
-        return bool(check_test.search(output))  # If unit tests pass, the code is correct
+        output = await coalesced_eval_python(test_string)
+        # If unit tests pass, the code is correct. Skip any output printed by the user's code
+        return bool(check_test.search(output, max(0, len(output) - check_test_tail)))
 
     @staticmethod
     def _get_assert_equal_string(input: str, output: str) -> str:
@@ -299,20 +321,10 @@ class WriteCodeQuestion(Question):
         to debug. However, since the code is running in a sandboxed environment, this method of generating tests
         poses no security risk.
         """
-        test_strings = []
-        for test_case in self.test_cases:
-            input = test_case["input"]
-            output = test_case["output"]
-            test_strings.append(self._get_assert_equal_string(input, output))
         return (
-            "import unittest\n"  # Import unittest module
-            + ("" if self.pre_code is None else self.pre_code)  # Adds code to run before user code, no newline after
+            self._test_prefix
             + user_code.expandtabs(2)  # Insert user code. Tabs -> spaces for consistency with test code
-            + "\nclass Test(unittest.TestCase):\n"  # Setup test class
-            + " def test_cases(self):"  # Setup test method
-            + "\n  "  # Indentation for first test case
-            + "\n  ".join(test_strings)  # Add assertions for test cases
-            + "\nunittest.main()"  # Run unit tests
+            + self._test_suffix
         )
 
     def get_embed_description(self, question_index: int) -> str:  # noqa: D102
@@ -394,7 +406,7 @@ class WriteCodeQuestionView(QuestionView):
 
         await modal.submit_interaction.response.defer(thinking=True, ephemeral=True)
         code_input = modal.code_input.value
-        output = await eval_python(code_input)
+        output = await coalesced_eval_python(code_input)
         await modal.submit_interaction.followup.send(
             embed=Embed(
                 title="Code Playground Results",
@@ -0,0 +1,41 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from utils import eval as eval_module
+from utils.eval import coalesced_eval_python
+
+
+class TestCoalescedEval(unittest.IsolatedAsyncioTestCase):
+    """Test sharing evaluations of identical code."""
+
+    async def test_concurrent_identical_code_is_evaluated_once(self) -> None:
+        """Test that identical code submitted at the same time runs once and every caller gets the output."""
+        release = asyncio.Event()
+
+        async def fake_eval_python(code: str) -> str:
+            await release.wait()
+            return "output of " + code
+
+        with mock.patch.object(eval_module, "eval_python", side_effect=fake_eval_python) as eval_python:
+            first = asyncio.create_task(coalesced_eval_python("print(1)"))
+            second = asyncio.create_task(coalesced_eval_python("print(1)"))
+            await asyncio.sleep(0)
+            release.set()
+            outputs = await asyncio.gather(first, second)
+
+        eval_python.assert_called_once_with("print(1)")
+        assert outputs == ["output of print(1)", "output of print(1)"]
+        assert eval_module.inflight_evals == {}
+
+    async def test_different_code_is_evaluated_separately(self) -> None:
+        """Test that different code is not shared."""
+
+        async def fake_eval_python(code: str) -> str:
+            return "output of " + code
+
+        with mock.patch.object(eval_module, "eval_python", side_effect=fake_eval_python) as eval_python:
+            outputs = await asyncio.gather(coalesced_eval_python("print(1)"), coalesced_eval_python("print(2)"))
+
+        eval_python.assert_has_calls([mock.call("print(1)"), mock.call("print(2)")], any_order=True)
+        assert outputs == ["output of print(1)", "output of print(2)"]
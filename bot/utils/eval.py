@@ -1,8 +1,37 @@
+import asyncio
+
 import async_tio
 
+inflight_evals: dict[str, asyncio.Task[str]] = {}  # Evaluations that are still running, by code
+
 
 async def eval_python(code: str) -> str:
     """Evaluate Python 3 code and return the output."""
     async with async_tio.Tio() as runner:
         output = await runner.execute(code, language="python3")
         return output.stdout
+
+
+def _on_eval_done(code: str, task: asyncio.Task[str]) -> None:
+    """Forget a finished evaluation.
+
+    The exception, if any, is retrieved here so asyncio doesn't log it as never retrieved when all callers waiting
+    for the evaluation were cancelled. Callers still waiting get the exception as usual.
+    """
+    inflight_evals.pop(code, None)
+    if not task.cancelled():
+        task.exception()
+
+
+async def coalesced_eval_python(code: str) -> str:
+    """Evaluate Python 3 code and return the output, sharing the evaluation with identical code already running.
+
+    Players often submit the same code several times in a row, so this saves duplicate runs in the sandbox.
+    """
+    task = inflight_evals.get(code)
+    if task is None:
+        task = asyncio.create_task(eval_python(code))
+        inflight_evals[code] = task
+        task.add_done_callback(lambda task: _on_eval_done(code, task))
+    # Shield the evaluation, so one caller being cancelled doesn't cancel it for the others
+    return await asyncio.shield(task)